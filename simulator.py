@@ -1,139 +1,479 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+import cv2
 import sqlite3
+import queue
+import threading
 import os
 import io
-import shutil
+import tempfile
+from contextlib import contextmanager
+# Enable oneDNN CPU kernels; must be set before TensorFlow is imported
+os.environ.setdefault('TF_ENABLE_ONEDNN_OPTS', '1')
+import tensorflow as tf
 from deepface import DeepFace
+import faiss
 from PIL import Image
 
 # --- CONFIGURATION ---
 DB_FILE = 'atm_data.db'
 ENROLLMENT_DIR = 'enrolled_faces'
-RECOGNITION_MODEL = "VGG-Face" 
+# Facenet: 128-D embeddings from a far smaller network than VGG-Face (4096-D)
+RECOGNITION_MODEL = "Facenet" 
+# Bump whenever embedding preprocessing changes, so stored vectors are recomputed at startup
+EMBEDDING_VERSION = 2
+# Faces embedded per forward pass when many accounts are processed at once; bounds host and GPU memory
+EMBEDDING_BATCH_SIZE = 64
 # Use OpenCV for face detection as it is generally the fastest CPU option
 DETECTOR_BACKEND = 'opencv' 
+# Camera frames are shrunk to this long edge before detection; faces stay well above the model's input size
+MAX_IMAGE_SIDE = 640
+# Maximum cosine distance between probe and enrolled embeddings to accept a match (DeepFace's Facenet value)
+MATCH_THRESHOLD = 0.40
+# Enrollment images are written under this prefix until their DB row is committed
+TEMP_IMAGE_PREFIX = 'enrolling-'
+# Number of long-lived SQLite connections shared by all sessions
+DB_POOL_SIZE = 8
 
 # --- 1. DATABASE & FILE SYSTEM MANAGEMENT ---
 
+@st.cache_resource
 def init_db():
-    """Initializes the SQLite database and the enrolled faces directory."""
+    """Initializes the SQLite database and the enrolled faces directory once per process."""
     os.makedirs(ENROLLMENT_DIR, exist_ok=True)
+    # Remove images left half-enrolled by a process that died before committing
+    for file_name in os.listdir(ENROLLMENT_DIR):
+        if file_name.startswith(TEMP_IMAGE_PREFIX):
+            os.remove(os.path.join(ENROLLMENT_DIR, file_name))
+    # Migrate on a dedicated connection closed before the pool opens, so no pooled
+    # connection can hold a schema from before the migration
     conn = sqlite3.connect(DB_FILE)
     c = conn.cursor()
     
     # Create the Users table
-    # Storing the image path rather than the embedding itself is more standard for DeepFace/find
+    # The embedding is computed once at enrollment so login never re-embeds the gallery
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
             account_no TEXT PRIMARY KEY,
             name TEXT NOT NULL,
             balance REAL NOT NULL,
-            enrolled_face_path TEXT UNIQUE NOT NULL
+            enrolled_face_path TEXT UNIQUE NOT NULL,
+            embedding BLOB,
+            embedding_model TEXT
         )
     ''')
+
+    # Databases created before embeddings were stored lack these columns
+    c.execute('PRAGMA table_info(users)')
+    columns = [row[1] for row in c.fetchall()]
+    if 'embedding' not in columns:
+        c.execute('ALTER TABLE users ADD COLUMN embedding BLOB')
+    if 'embedding_model' not in columns:
+        c.execute('ALTER TABLE users ADD COLUMN embedding_model TEXT')
     conn.commit()
     conn.close()
 
+@st.cache_resource
+def get_db_pool():
+    """Opens a pool of WAL-mode connections that survives Streamlit reruns."""
+    # The schema must be final before any pooled connection loads it
+    init_db()
+    pool = queue.Queue()
+    for _ in range(DB_POOL_SIZE):
+        # Autocommit mode: each statement commits unless a transaction is opened explicitly
+        conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+        conn.executescript('''
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA mmap_size=268435456;
+        ''')
+        pool.put(conn)
+    return pool
+
+@contextmanager
 def get_db_connection():
-    """Returns a connection to the SQLite database."""
-    return sqlite3.connect(DB_FILE)
+    """Borrows a pooled connection to the SQLite database for the duration of a with block."""
+    pool = get_db_pool()
+    conn = pool.get()
+    try:
+        yield conn
+    finally:
+        # Never hand a half-finished transaction to the next borrower
+        if conn.in_transaction:
+            conn.rollback()
+        pool.put(conn)
+
+def embedding_tag(model_name):
+    """Returns the embedding_model value identifying vectors from this model and preprocessing version."""
+    return f"{model_name}/v{EMBEDDING_VERSION}"
+
+def quantize_embedding(embedding):
+    """Quantizes a unit-length embedding to int8 with a per-vector float32 scale."""
+    scale = np.float32(np.max(np.abs(embedding)) / 127)
+    quantized = np.round(embedding / scale).astype(np.int8)
+    return scale, quantized
+
+def pack_embedding(embedding):
+    """Serializes an embedding for the DB as its 4-byte scale followed by the int8 components."""
+    scale, quantized = quantize_embedding(embedding)
+    return scale.tobytes() + quantized.tobytes()
+
+def unpack_embedding(blob):
+    """Restores a stored embedding blob to a float32 vector."""
+    scale = np.frombuffer(blob[:4], dtype=np.float32)[0]
+    return np.frombuffer(blob[4:], dtype=np.int8).astype(np.float32) * scale
 
 # --- 2. CACHING AND MODEL LOADING (CPU Optimization) ---
 
+def configure_tensorflow():
+    """Places inference on the GPU when one is present, otherwise spreads it across all CPU cores."""
+    gpus = tf.config.list_physical_devices('GPU')
+    try:
+        if gpus:
+            # Allocate GPU memory on demand instead of reserving the whole card
+            for gpu in gpus:
+                tf.config.experimental.set_memory_growth(gpu, True)
+        else:
+            tf.config.threading.set_intra_op_parallelism_threads(os.cpu_count())
+    except RuntimeError:
+        # TensorFlow was already initialized in this process; keep its settings
+        pass
+    return bool(gpus)
+
+def enable_mixed_precision():
+    """Builds subsequent models with float16 compute and float32 weights."""
+    # DeepFace builds its models with tf-keras on TensorFlow 2.16+, and tf.keras before that
+    try:
+        import tf_keras as keras
+    except ImportError:
+        from tensorflow import keras
+    keras.mixed_precision.set_global_policy('mixed_float16')
+
 @st.cache_resource
 def load_face_recognizer(model_name: str):
     """Initializes and caches the DeepFace model for single-time loading."""
     st.info(f"Loading the {model_name} Deep Learning model... (CPU Optimization)")
     try:
-        # DeepFace.build_model() ensures the model is loaded and ready.
-        DeepFace.build_model(model_name=model_name)
-        st.success(f"Model ({model_name}) loaded successfully and cached.")
+        # Device settings only take effect before the first model is built
+        device = "GPU" if configure_tensorflow() else "CPU"
+        if device == "GPU":
+            # Half-precision math runs on the GPU's tensor cores; CPUs gain nothing from it
+            enable_mixed_precision()
+        # Load the underlying Keras network once; embeddings call it directly
+        load_embedding_model(model_name)
+        warm_up_recognizer(model_name)
+        backfill_embeddings(model_name)
+        # Build the gallery index now rather than on the first login
+        load_gallery_index(model_name)
+        st.success(f"Model ({model_name}) loaded successfully on {device} and cached.")
         return model_name
     except Exception as e:
         st.error(f"Error loading DeepFace model: {e}")
         st.stop()
 
+@st.cache_resource
+def load_embedding_model(model_name):
+    """Returns the model's raw Keras network and its (width, height) input size, as DeepFace reports it."""
+    client = DeepFace.build_model(model_name=model_name)
+    return client.model, client.input_shape
+
+def resize_face_chip(face, target_size):
+    """Fits a face chip into the model's (width, height) input with centered zero padding."""
+    target_w, target_h = target_size
+    h, w = face.shape[:2]
+    factor = min(target_h / h, target_w / w)
+    face = cv2.resize(face, (max(1, int(w * factor)), max(1, int(h * factor))))
+    pad_h, pad_w = target_h - face.shape[0], target_w - face.shape[1]
+    return np.pad(face, ((pad_h // 2, pad_h - pad_h // 2), (pad_w // 2, pad_w - pad_w // 2), (0, 0)))
+
+def embed_faces(faces, model_name):
+    """
+    Embeds extract_faces chips (RGB floats in [0, 1]) with one direct forward pass.
+    Returns an (N, D) float32 matrix of L2-normalized embeddings.
+    """
+    model, input_shape = load_embedding_model(model_name)
+    # DeepFace.represent flips chips to BGR before the forward pass; the match thresholds assume that layout
+    batch = np.stack([resize_face_chip(face[:, :, ::-1], input_shape) for face in faces]).astype(np.float32)
+    # Calling the network skips DeepFace.represent's per-call model lookup and preprocessing layers
+    embeddings = np.asarray(model(batch, training=False), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings
+
+def detect_face(img_path):
+    """Returns the aligned chip of the first face in an image, raising ValueError if none is found."""
+    faces = DeepFace.extract_faces(img_path=img_path, detector_backend=DETECTOR_BACKEND, enforce_detection=True)
+    return faces[0]['face']
+
+def compute_embedding(img_path, model_name):
+    """Returns the L2-normalized float32 embedding of the face in an image."""
+    return embed_faces([detect_face(img_path)], model_name)[0]
+
+def downscale_image(img, max_side=MAX_IMAGE_SIDE):
+    """Returns the image shrunk so its long edge is at most max_side pixels."""
+    h, w = img.shape[:2]
+    scale = max_side / max(h, w)
+    if scale >= 1:
+        return img
+    # INTER_AREA averages source pixels, avoiding aliasing when shrinking
+    return cv2.resize(img, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+
+def decode_image(image_bytes, max_side=MAX_IMAGE_SIDE):
+    """
+    Decodes encoded image bytes to a BGR array whose long edge is at most max_side pixels.
+    Returns the array and the original long edge, raising ValueError if the data cannot be decoded.
+    """
+    # Only the header is parsed here; the pixels are decoded once, by OpenCV
+    try:
+        long_edge = max(Image.open(io.BytesIO(image_bytes)).size)
+    except OSError:
+        raise ValueError("The captured image is not a readable picture. Please take the picture again.")
+    flag = cv2.IMREAD_COLOR
+    # For JPEGs, libjpeg scales large frames down inside the IDCT instead of decoding every pixel
+    for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if long_edge // factor >= max_side:
+            flag = reduced_flag
+            break
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), flag)
+    if img is None:
+        raise ValueError("The captured image could not be decoded. Please take the picture again.")
+    return downscale_image(img, max_side), long_edge
+
+def warm_up_recognizer(model_name):
+    """Runs one throwaway forward pass so graph setup is paid at boot, not at the first login."""
+    embed_faces([np.zeros((224, 224, 3), dtype=np.float32)], model_name)
+
+def backfill_embeddings(model_name):
+    """Computes embeddings for accounts with none stored, or one from a different model or version."""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('''
+            SELECT account_no, enrolled_face_path FROM users
+            WHERE embedding IS NULL OR embedding_model IS NOT ?
+        ''', (embedding_tag(model_name),))
+        stale = c.fetchall()
+
+        # Detect, embed and store a chunk at a time so only one batch of chips is ever held
+        for start in range(0, len(stale), EMBEDDING_BATCH_SIZE):
+            account_nos, faces = [], []
+            for account_no, face_path in stale[start:start + EMBEDDING_BATCH_SIZE]:
+                try:
+                    faces.append(detect_face(face_path))
+                except Exception:
+                    # Missing or faceless image: the account cannot be matched until re-enrolled
+                    continue
+                account_nos.append(account_no)
+
+            if not faces:
+                continue
+            embeddings = embed_faces(faces, model_name)
+            c.executemany('UPDATE users SET embedding=?, embedding_model=? WHERE account_no=?',
+                          [(pack_embedding(embedding), embedding_tag(model_name), account_no)
+                           for account_no, embedding in zip(account_nos, embeddings)])
+
+@st.cache_resource
+def load_gallery_index(model_name):
+    """Builds the in-memory 8-bit FAISS index over a model's enrolled embeddings, shared by all sessions."""
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT account_no, embedding FROM users WHERE embedding_model=?', (embedding_tag(model_name),))
+        rows = c.fetchall()
+
+    # FAISS indexes are not safe to search while another thread adds to them
+    gallery = {'index': None, 'account_nos': [], 'lock': threading.Lock()}
+    if rows:
+        add_to_gallery_index(gallery, [row[0] for row in rows], np.vstack([unpack_embedding(row[1]) for row in rows]))
+    return gallery
+
+def new_gallery_index(dim):
+    """Creates an inner-product index that keeps vectors as 8-bit codes, one byte per dimension."""
+    index = faiss.IndexScalarQuantizer(dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_INNER_PRODUCT)
+    # Components of unit vectors lie in [-1, 1]; training on those bounds fixes the code range up front,
+    # so vectors enrolled later are never clipped to a range learned from the first few users
+    bounds = np.vstack([-np.ones(dim, dtype=np.float32), np.ones(dim, dtype=np.float32)])
+    index.train(bounds)
+    return index
+
+def add_to_gallery_index(gallery, account_nos, embeddings):
+    """Appends (N, D) embeddings to the gallery index, keeping account numbers aligned with index ids."""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    # Re-normalize: int8 storage leaves vectors only approximately unit length
+    faiss.normalize_L2(embeddings)
+    with gallery['lock']:
+        if gallery['index'] is None:
+            gallery['index'] = new_gallery_index(embeddings.shape[1])
+        gallery['index'].add(embeddings)
+        gallery['account_nos'].extend(account_nos)
+
+def search_gallery_index(gallery, embedding):
+    """Returns the closest enrolled account number and its cosine similarity, or (None, None) if empty."""
+    with gallery['lock']:
+        if gallery['index'] is None:
+            return None, None
+        # FAISS scans the 8-bit codes directly with its SIMD scalar-quantizer kernel, no BLAS involved
+        scores, ids = gallery['index'].search(embedding.reshape(1, -1), 1)
+        return gallery['account_nos'][ids[0][0]], float(scores[0][0])
+
 # --- 3. CORE LOGIC (Enrollment and Transaction Handlers) ---
 
 def enroll_user(account_no, name, initial_deposit, image_bytes):
     """
-    Handles user enrollment: saves the image, checks for face, and records data in DB.
+    Handles user enrollment: checks for a face, saves the image, and records data in DB.
     """
-    conn = get_db_connection()
-    c = conn.cursor()
-    
     # Check if Account No already exists
-    c.execute('SELECT account_no FROM users WHERE account_no=?', (account_no,))
-    if c.fetchone():
-        conn.close()
-        return False, "Error: Account number already exists."
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        c.execute('SELECT account_no FROM users WHERE account_no=?', (account_no,))
+        if c.fetchone():
+            return False, "Error: Account number already exists."
 
-    # 1. Save Image
     user_file_name = f"{account_no}.jpg"
     file_path = os.path.join(ENROLLMENT_DIR, user_file_name)
     
-    # Convert bytes to PIL Image and save
+    # 1. Decode Image in memory
     try:
-        image = Image.open(io.BytesIO(image_bytes))
-        image.save(file_path)
+        image, long_edge = decode_image(image_bytes)
+        if long_edge <= MAX_IMAGE_SIDE:
+            # The camera already delivers an encoded image: store the bytes as-is
+            image_data = bytes(image_bytes)
+        else:
+            # Large frames: only the reduced copy is kept on disk so later reads decode fewer pixels
+            ok, encoded = cv2.imencode('.jpg', image)
+            if not ok:
+                raise ValueError("The reduced image could not be encoded.")
+            image_data = encoded.tobytes()
     except Exception as e:
-        conn.close()
-        return False, f"Error saving image file: {e}"
+        return False, f"Error reading image file: {e}"
 
     # 2. Verify Face Detection (Crucial for reliable authentication later)
     try:
         # Check if a face is detected in the new image
-        DeepFace.extract_faces(img_path=file_path, detector_backend=DETECTOR_BACKEND, enforce_detection=True)
+        embedding = compute_embedding(image, RECOGNITION_MODEL)
     except ValueError as e:
-        # If no face is detected, clean up the file
-        os.remove(file_path)
-        conn.close()
         return False, "Error: No clear face detected in the image. Enrollment failed."
     except Exception as e:
         # Other DeepFace errors
-        os.remove(file_path)
-        conn.close()
         return False, f"DeepFace processing error: {e}"
 
-    # 3. Record Data in DB
+    # 3. Save Image under a temporary name; it only takes its final name once the DB row is committed
     try:
-        c.execute('INSERT INTO users VALUES (?, ?, ?, ?)', 
-                  (account_no, name, initial_deposit, file_path))
-        conn.commit()
-        conn.close()
-        return True, "User successfully enrolled and account created!"
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_IMAGE_PREFIX, dir=ENROLLMENT_DIR)
+    except Exception as e:
+        return False, f"Error saving image file: {e}"
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(image_data)
+        # mkstemp creates owner-only files; give enrolled images the usual rw-r--r-- mode
+        os.chmod(temp_path, 0o644)
+    except Exception as e:
+        os.remove(temp_path)
+        return False, f"Error saving image file: {e}"
+
+    # 4. Record Data in DB
+    # Build the index before committing; a cold index built afterwards would already hold this row
+    gallery = load_gallery_index(RECOGNITION_MODEL)
+    try:
+        embedding_blob = pack_embedding(embedding)
+        with get_db_connection() as conn:
+            # Re-check inside the write transaction: another session may have enrolled this account meanwhile
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute('SELECT account_no FROM users WHERE account_no=?', (account_no,)).fetchone():
+                os.remove(temp_path)
+                return False, "Error: Account number already exists."
+            conn.execute('INSERT INTO users VALUES (?, ?, ?, ?, ?, ?)', 
+                         (account_no, name, initial_deposit, file_path, embedding_blob, embedding_tag(RECOGNITION_MODEL)))
+            conn.commit()
     except Exception as e:
-        # If DB insertion fails, clean up the saved image file
-        os.remove(file_path)
-        conn.close()
+        # If DB insertion fails, clean up the temporary image file
+        os.remove(temp_path)
         return False, f"Database insertion error: {e}"
 
+    # 5. Move the image into place (atomic within ENROLLMENT_DIR)
+    try:
+        os.replace(temp_path, file_path)
+    except Exception as e:
+        # Undo the enrollment: drop the row first so no account is left without its face image
+        try:
+            with get_db_connection() as conn:
+                conn.execute('DELETE FROM users WHERE account_no=?', (account_no,))
+            os.remove(temp_path)
+        except Exception as undo_error:
+            return False, f"Error saving image file: {e}. The account could not be rolled back: {undo_error}"
+        return False, f"Error saving image file: {e}"
+
+    # Index the stored (quantized) vector so a later rebuild from the DB gives identical results
+    add_to_gallery_index(gallery, [account_no], unpack_embedding(embedding_blob)[None, :])
+    return True, "User successfully enrolled and account created!"
+
+def bulk_enroll(users):
+    """
+    Enrolls many users in a single transaction, e.g. from admin tooling.
+    Each entry is (account_no, name, initial_deposit, face_path) with the face image already saved.
+    """
+    users = list(users)
+    if not users:
+        return False, "Error: No users to enroll."
+
+    # Detect and embed a chunk at a time so only one batch of chips is ever held;
+    # the packed rows are small, so all of them are still inserted in one transaction
+    rows = []
+    for start in range(0, len(users), EMBEDDING_BATCH_SIZE):
+        chunk = users[start:start + EMBEDDING_BATCH_SIZE]
+        faces = []
+        for account_no, name, initial_deposit, face_path in chunk:
+            try:
+                faces.append(detect_face(face_path))
+            except Exception as e:
+                return False, f"Enrollment failed for account {account_no}: {e}"
+
+        embeddings = embed_faces(faces, RECOGNITION_MODEL)
+        rows.extend((account_no, name, initial_deposit, face_path, pack_embedding(embedding), embedding_tag(RECOGNITION_MODEL))
+                    for (account_no, name, initial_deposit, face_path), embedding in zip(chunk, embeddings))
+
+    # Build the index before committing; a cold index built afterwards would already hold these rows
+    gallery = load_gallery_index(RECOGNITION_MODEL)
+    try:
+        with get_db_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.executemany('''
+                INSERT INTO users (account_no, name, balance, enrolled_face_path, embedding, embedding_model)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+    except Exception as e:
+        return False, f"Database insertion error: {e}"
+
+    add_to_gallery_index(
+        gallery,
+        [row[0] for row in rows],
+        np.vstack([unpack_embedding(row[4]) for row in rows])
+    )
+    return True, f"{len(rows)} users successfully enrolled."
+
 def update_balance(account_no, amount, transaction_type):
     """Handles deposit or withdrawal and updates the balance in the database."""
-    conn = get_db_connection()
-    c = conn.cursor()
-    
-    # Get current balance
-    c.execute('SELECT balance FROM users WHERE account_no=?', (account_no,))
-    current_balance = c.fetchone()[0]
-
-    if transaction_type == 'Withdrawal':
-        if current_balance < amount:
-            conn.close()
-            return False, "Insufficient funds."
-        new_balance = current_balance - amount
-    elif transaction_type == 'Deposit':
-        new_balance = current_balance + amount
-    else:
-        conn.close()
-        return False, "Invalid transaction type."
-
-    # Update database
-    c.execute('UPDATE users SET balance=? WHERE account_no=?', (new_balance, account_no))
-    conn.commit()
-    conn.close()
+    with get_db_connection() as conn:
+        c = conn.cursor()
+        # Take the write lock before reading so concurrent sessions cannot lose an update
+        c.execute('BEGIN IMMEDIATE')
+        
+        # Get current balance
+        c.execute('SELECT balance FROM users WHERE account_no=?', (account_no,))
+        current_balance = c.fetchone()[0]
+
+        if transaction_type == 'Withdrawal':
+            if current_balance < amount:
+                return False, "Insufficient funds."
+            new_balance = current_balance - amount
+        elif transaction_type == 'Deposit':
+            new_balance = current_balance + amount
+        else:
+            return False, "Invalid transaction type."
+
+        # Update database
+        c.execute('UPDATE users SET balance=? WHERE account_no=?', (new_balance, account_no))
+        conn.commit()
     
     # Update session state for immediate UI refresh
     st.session_state.user_account['balance'] = new_balance
@@ -176,62 +516,31 @@ def show_login_view(model_name):
     if auth_button_pressed:
         if captured_image is not None:
             
-            # Define paths for the probe image and the clean database
-            PROBE_FILE = os.path.join(ENROLLMENT_DIR, 'temp_auth_file.jpg')
-            TEMP_DB_DIR = 'temp_clean_db' 
-            
-            # 1. Save the captured image to the defined probe file path
-            image = Image.open(captured_image)
-            image.save(PROBE_FILE)
-            
-            # 2. Create a clean database directory for DeepFace to search
-            # This is the key step to prevent matching the probe file itself.
-            os.makedirs(TEMP_DB_DIR, exist_ok=True)
-            
-            # Copy only the permanent enrolled user files to the temporary DB directory
-            enrolled_files = [f for f in os.listdir(ENROLLMENT_DIR) if f != os.path.basename(PROBE_FILE)]
-            for file_name in enrolled_files:
-                shutil.copy(os.path.join(ENROLLMENT_DIR, file_name), TEMP_DB_DIR)
-
             # Reset the debug message state
-            st.session_state['debug_match_path'] = None
+            st.session_state['debug_match_account'] = None
             
             with st.spinner('Running Biometric Verification...'):
                 try:
-                    # DeepFace search: Use PROBE_FILE as input, and TEMP_DB_DIR as the search directory
-                    results = DeepFace.find(
-                        img_path=PROBE_FILE, 
-                        db_path=TEMP_DB_DIR, # Search the clean directory!
-                        model_name=model_name, 
-                        detector_backend=DETECTOR_BACKEND,
-                        enforce_detection=True 
-                    )
+                    # Decode the capture in memory; DeepFace accepts the BGR array directly
+                    probe_image, _ = decode_image(captured_image.getbuffer())
+
+                    # Embed only the probe; the gallery embeddings were stored at enrollment
+                    probe_embedding = compute_embedding(probe_image, model_name)
+                    best_match_account, similarity = search_gallery_index(load_gallery_index(model_name), probe_embedding)
                     
                     user_data = None
                     
                     # 1. PROCESS RESULTS
-                    if results and isinstance(results, list) and len(results) > 0 and not results[0].empty:
-                        
-                        # Get the closest matching enrolled image path (e.g., 'temp_clean_db/1001.jpg')
-                        best_match_path_raw = results[0]['identity'].iloc[0]
-                        
-                        # The path returned by DeepFace is relative to TEMP_DB_DIR. 
-                        # We must convert it back to the original ENROLLMENT_DIR path for the DB query.
-                        
-                        # Extract just the filename (e.g., '1001.jpg')
-                        match_filename = os.path.basename(best_match_path_raw)
-                        
-                        # Construct the original path stored in the database
-                        best_match_path = os.path.join(ENROLLMENT_DIR, match_filename)
-                        best_match_path = os.path.normpath(best_match_path) # Final normalization
-                        st.session_state['debug_match_path'] = best_match_path
+                    # Inner product of unit vectors is the cosine similarity
+                    if best_match_account is not None and 1.0 - similarity <= MATCH_THRESHOLD:
+                        st.session_state['debug_match_account'] = best_match_account
 
                         # 2. Retrieve User Data from DB
-                        conn = get_db_connection()
-                        c = conn.cursor()
-                        c.execute('SELECT * FROM users WHERE enrolled_face_path=?', (best_match_path,))
-                        user_data = c.fetchone()
-                        conn.close()
+                        with get_db_connection() as conn:
+                            c = conn.cursor()
+                            c.execute('SELECT account_no, name, balance, enrolled_face_path FROM users WHERE account_no=?',
+                                      (best_match_account,))
+                            user_data = c.fetchone()
                         
                     # 3. FINAL CHECK AND REDIRECT
                     if user_data:
@@ -248,18 +557,11 @@ def show_login_view(model_name):
                         st.rerun() 
                     else:
                         st.error("❌ Authentication Failed. Face not recognized or user data not linked correctly.")
-                        if st.session_state.get('debug_match_path'):
-                             st.error(f"DEBUG: Failed to find user in DB using path: {st.session_state['debug_match_path']}")
+                        if st.session_state.get('debug_match_account'):
+                             st.error(f"DEBUG: Failed to find user in DB using account: {st.session_state['debug_match_account']}")
 
                 except Exception as e:
                     st.error(f"Error during verification. Please ensure your face is clearly visible. DeepFace Error: {e}")
-                
-                finally:
-                    # CLEANUP: Remove the probe file AND the temporary clean database directory
-                    if os.path.exists(PROBE_FILE):
-                        os.remove(PROBE_FILE)
-                    if os.path.exists(TEMP_DB_DIR):
-                        shutil.rmtree(TEMP_DB_DIR) # Recursively delete the temporary directory
         
         else:
             st.warning("Please capture your face image using the camera input before authenticating.")